@@ -1,5 +1,6 @@
 import streamlit as st
 import folium
+from jinja2 import Template
 from streamlit_folium import st_folium
 import requests
 import json
@@ -10,7 +11,13 @@ from typing import Dict, List, Tuple, Optional
 import time
 import pandas as pd
 import os
+import tempfile
 import traceback
+import hashlib
+import threading
+import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # Page configuration MUST be first  
 st.set_page_config(
@@ -20,13 +27,171 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Upstream services (overridable, e.g. to point the load test at a local stub)
+USGS_IV_URL = os.environ.get('USGS_IV_URL', "https://waterservices.usgs.gov/nwis/iv/")
+USGS_DV_URL = os.environ.get('USGS_DV_URL', "https://waterservices.usgs.gov/nwis/dv/")
+STREAMSTATS_FLOWPATH_URL = os.environ.get('STREAMSTATS_FLOWPATH_URL', "https://streamstats.usgs.gov/streamstatsservices/navigation/flowpath")
+
+# Whole-river GeoJSON export (served by Streamlit static file serving)
+RIVER_GEOJSON_DIR = os.environ.get('RIVER_GEOJSON_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+RIVER_GEOJSON_PREFIX = 'cumberland_river_'
+RIVER_GEOJSON_RETENTION_SECONDS = 3600  # Snapshot files no session has published for an hour are pruned
+RIVER_SNAPSHOT_TTL_SECONDS = 900
+# Douglas-Peucker tolerance (degrees) per map zoom level
+RIVER_GEOJSON_ZOOM_TOLERANCES = {6: 0.02, 9: 0.005, 12: 0.0}
+
+# USGS API key limits (api.data.gov default: 1,000 requests per hour)
+USGS_RATE_LIMIT_PER_HOUR = float(os.environ.get('USGS_RATE_LIMIT_PER_HOUR', 1000))
+USGS_RATE_LIMIT_BURST = int(os.environ.get('USGS_RATE_LIMIT_BURST', 20))
+# Instantaneous values update every 15 minutes; reuse successful responses for a while
+USGS_RESPONSE_TTL_SECONDS = int(os.environ.get('USGS_RESPONSE_TTL_SECONDS', 300))
+# Operator-only: show USGSApiClient.get_metrics() in the sidebar
+SHOW_USGS_METRICS = os.environ.get('SHOW_USGS_METRICS', '').lower() in ('1', 'true', 'yes')
+USGS_RESPONSE_CACHE_MAX_ENTRIES = 64
+
+# Historical daily values and day-of-year flow histograms
+FLOW_HISTORY_DB = os.environ.get('FLOW_HISTORY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flow_history.sqlite'))
+FLOW_HISTORY_START_DATE = '1950-01-01'
+FLOW_HISTORY_TIMEOUT_SECONDS = 120
+FLOW_HISTORY_BATCH_SIZE = 1000  # Days stored per transaction during a backfill
+FLOW_HISTOGRAM_BUCKETS = 200
+FLOW_HISTOGRAM_LOG10_RANGE = (1.0, 6.0)  # 10 to 1,000,000 cfs
+FLOW_PERCENTILE_WINDOW_DAYS = 7  # Pool +/- 7 days of year around the date
+
+# Latency budget for one rerun; slow upstream requests are hedged after the given latency percentile
+RERUN_DEADLINE_SECONDS = float(os.environ.get('RERUN_DEADLINE_SECONDS', 4.0))
+UPSTREAM_TIMEOUT_SECONDS = 15
+HEDGE_LATENCY_PERCENTILE = 90
+HEDGE_DEFAULT_DELAY_SECONDS = 1.0
+STREAMSTATS_MIN_BUDGET_SECONDS = 1.0
+
+class Deadline:
+    """Time budget shared by every upstream call made during one rerun"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Per-request timeout: the cap, shortened to what is left of the budget"""
+        return min(cap, self.remaining())
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter"""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def acquire(self, timeout: float) -> bool:
+        """Take one token, waiting up to timeout seconds; False if none became available"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            while True:
+                with self._lock:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    sleep_for = (1 - self._tokens) / self.rate_per_second
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or sleep_for > remaining:
+                    with self._lock:
+                        self.rejected += 1
+                    return False
+                time.sleep(sleep_for)
+        finally:
+            with self._lock:
+                self.queue_depth -= 1
+
+    def try_acquire(self) -> bool:
+        """Take one token only if one is available right now"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+class SingleFlight:
+    """Coalesces calls with the same key into one background call that callers join until it finishes"""
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def submit(self, key, fn) -> Future:
+        """Start fn in the background, or return the future of the in-flight call with this key"""
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = self._executor.submit(fn)
+            self._calls[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future: Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
 class USGSApiClient:
     """Secure USGS API client"""
-    
+
     def __init__(self):
         self._api_key = self._get_api_key()
         self._base_headers = {'User-Agent': 'Cumberland-River-Flow-Calculator/1.0', 'Accept': 'application/json'}
-    
+        self._rate_limiter = TokenBucket(USGS_RATE_LIMIT_PER_HOUR / 3600, USGS_RATE_LIMIT_BURST)
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='usgs')
+        self._single_flight = SingleFlight(ThreadPoolExecutor(max_workers=16, thread_name_prefix='usgs-flight'))
+        self._lock = threading.Lock()
+        self._response_cache = {}
+        self._last_flow_data = {}
+        self._latencies = deque(maxlen=200)
+        self.upstream_requests = 0
+        self.hedged_requests = 0
+
+    def get_metrics(self) -> Dict:
+        """Request coalescing and rate limiter metrics"""
+        calls = self._single_flight.calls
+        return {
+            'calls': calls,
+            'coalesced_calls': self._single_flight.coalesced,
+            'coalescing_ratio': self._single_flight.coalesced / calls if calls else 0.0,
+            'upstream_requests': self.upstream_requests,
+            'hedged_requests': self.hedged_requests,
+            'hedge_delay_s': self._hedge_delay(),
+            'queue_depth': self._rate_limiter.queue_depth,
+            'max_queue_depth': self._rate_limiter.max_queue_depth,
+            'rate_limited': self._rate_limiter.rejected
+        }
+
     def _get_api_key(self) -> str:
         api_key = os.environ.get('USGS_API_KEY')
         if api_key:
@@ -38,17 +203,104 @@ class USGSApiClient:
             pass
         return "uit0NM8NFAPPW9jNDcIQHJpXHgGaih1Q697anjSy"
     
-    def _make_request(self, url: str, params: dict, timeout: int = 10) -> Optional[requests.Response]:
+    def _hedge_delay(self) -> float:
+        """Latency after which a second, hedged request is sent"""
+        with self._lock:
+            latencies = list(self._latencies)
+        if len(latencies) < 10:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return float(np.percentile(latencies, HEDGE_LATENCY_PERCENTILE))
+
+    def _timed_get(self, url: str, params: dict, timeout: float) -> requests.Response:
+        start = time.monotonic()
+        response = requests.get(url, params=params, headers=self._base_headers, timeout=timeout)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return response
+
+    def _get(self, url: str, params: dict, deadline: Deadline) -> requests.Response:
+        """Rate-limited GET bounded by the deadline, hedged with a second request when slow"""
+        timeout = deadline.timeout(UPSTREAM_TIMEOUT_SECONDS)
+        if timeout <= 0:
+            raise requests.exceptions.Timeout("Deadline exceeded")
+        if not self._rate_limiter.acquire(timeout):
+            raise requests.exceptions.RequestException("USGS client-side rate limit exceeded")
+        with self._lock:
+            self.upstream_requests += 1
+
+        futures = [self._executor.submit(self._timed_get, url, params, timeout)]
+        done, _ = wait(futures, timeout=min(self._hedge_delay(), deadline.remaining()))
+        if not done and not deadline.expired() and self._rate_limiter.try_acquire():
+            with self._lock:
+                self.upstream_requests += 1
+                self.hedged_requests += 1
+            futures.append(self._executor.submit(self._timed_get, url, params, deadline.timeout(UPSTREAM_TIMEOUT_SECONDS)))
+
+        # First successful response wins; stragglers finish in the background
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise requests.exceptions.Timeout("Deadline exceeded")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+        return futures[0].result()
+
+    def _get_cached_response(self, key) -> Optional[requests.Response]:
+        with self._lock:
+            cached = self._response_cache.get(key)
+            if cached is None:
+                return None
+            if cached[0] <= time.monotonic():
+                del self._response_cache[key]
+                return None
+            return cached[1]
+
+    def _cache_response(self, key, response: requests.Response):
+        """Store a response, dropping expired entries and then the oldest ones beyond the size cap"""
+        now = time.monotonic()
+        with self._lock:
+            self._response_cache.pop(key, None)
+            for expired_key in [k for k, (expires, _) in self._response_cache.items() if expires <= now]:
+                del self._response_cache[expired_key]
+            while len(self._response_cache) >= USGS_RESPONSE_CACHE_MAX_ENTRIES:
+                del self._response_cache[next(iter(self._response_cache))]
+            self._response_cache[key] = (now + USGS_RESPONSE_TTL_SECONDS, response)
+
+    def _make_request(self, url: str, params: dict, deadline: Optional[Deadline] = None, on_response=None) -> Optional[requests.Response]:
+        deadline = deadline or Deadline(UPSTREAM_TIMEOUT_SECONDS)
+        key = (url, tuple(sorted(params.items())))
+        cached = self._get_cached_response(key)
+        if cached is not None:
+            return cached
+
+        # Callers join the in-flight upstream call for the same request until it finishes, even
+        # after their own deadline has passed, so a slow response still lands in the cache
+        future = self._single_flight.submit(key, lambda: self._fetch(key, url, params, on_response))
+        done, _ = wait([future], timeout=deadline.remaining())
+        return future.result() if done else None
+
+    def _fetch(self, key, url: str, params: dict, on_response=None) -> Optional[requests.Response]:
+        """Upstream call with its own full timeout, independent of the caller's deadline"""
+        response = self._make_request_uncoalesced(url, params, Deadline(UPSTREAM_TIMEOUT_SECONDS))
+        if response is not None:
+            self._cache_response(key, response)
+            if on_response:
+                on_response(response)
+        return response
+
+    def _make_request_uncoalesced(self, url: str, params: dict, deadline: Deadline) -> Optional[requests.Response]:
         try:
             auth_params = params.copy()
-            response = requests.get(url, params=auth_params, headers=self._base_headers, timeout=timeout)
+            response = self._get(url, auth_params, deadline)
             response.raise_for_status()
             return response
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 400:
                 basic_params = {k: v for k, v in params.items() if k in ['format', 'sites', 'parameterCd', 'startDT', 'endDT', 'siteOutput']}
                 try:
-                    response = requests.get(url, params=basic_params, headers=self._base_headers, timeout=timeout)
+                    response = self._get(url, basic_params, deadline)
                     response.raise_for_status()
                     return response
                 except:
@@ -59,9 +311,10 @@ class USGSApiClient:
     
     def get_site_info(self, site_id: str) -> Optional[Dict]:
         try:
-            url = "https://waterservices.usgs.gov/nwis/iv/"
+            url = USGS_IV_URL
             params = {'format': 'json', 'sites': site_id, 'parameterCd': '00060', 'period': 'P1D'}
-            response = self._make_request(url, params, timeout=15)
+            # Same request as get_flow_data, so the response also updates the last known flow
+            response = self._make_request(url, params, on_response=lambda r: self._parse_flow_data(site_id, r))
             if not response:
                 return None
             data = response.json()
@@ -73,13 +326,49 @@ class USGSApiClient:
         except:
             return None
     
-    def get_flow_data(self, site_id: str, days_back: int = 1) -> Optional[Dict]:
+    def get_daily_values(self, site_id: str, start_date: str) -> Optional[List[Tuple[str, float]]]:
+        """Fetch daily mean discharge (NWIS dv) from start_date onwards as (date, cfs) pairs"""
+        # A backfill is large and slow by nature: rate-limited, but not hedged, timed or cached
+        # like the interactive requests
         try:
-            url = "https://waterservices.usgs.gov/nwis/iv/"
-            params = {'format': 'json', 'sites': site_id, 'parameterCd': '00060', 'period': 'P1D'}
-            response = self._make_request(url, params, timeout=15)
-            if not response:
+            params = {'format': 'json', 'sites': site_id, 'parameterCd': '00060', 'statCd': '00003', 'startDT': start_date}
+            if not self._rate_limiter.acquire(FLOW_HISTORY_TIMEOUT_SECONDS):
                 return None
+            with self._lock:
+                self.upstream_requests += 1
+            response = requests.get(USGS_DV_URL, params=params, headers=self._base_headers, timeout=FLOW_HISTORY_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            data = response.json()
+            daily_values = []
+            for time_series in data.get('value', {}).get('timeSeries', []):
+                for series_values in time_series.get('values', []):
+                    for value in series_values.get('value', []):
+                        flow = float(value['value'])
+                        if flow >= 0:  # NWIS uses -999999 for missing values
+                            daily_values.append((value['dateTime'][:10], flow))
+            return daily_values
+        except:
+            return None
+
+    def get_cached_flow_data(self, site_id: str) -> Optional[Dict]:
+        """Last successfully fetched flow data for a site, however old"""
+        return self._last_flow_data.get(site_id)
+
+    def get_flow_data(self, site_id: str, days_back: int = 1, deadline: Optional[Deadline] = None) -> Optional[Dict]:
+        url = USGS_IV_URL
+        params = {'format': 'json', 'sites': site_id, 'parameterCd': '00060', 'period': 'P1D'}
+        # Parse on arrival too, so a response that outlives the deadline still updates the last known flow
+        try:
+            response = self._make_request(url, params, deadline, on_response=lambda r: self._parse_flow_data(site_id, r))
+        except:
+            return None
+        if not response:
+            return None
+        return self._parse_flow_data(site_id, response)
+
+    def _parse_flow_data(self, site_id: str, response: requests.Response) -> Optional[Dict]:
+        """Extract the latest value from an instantaneous values response and remember it"""
+        try:
             data = response.json()
             if ('value' in data and 'timeSeries' in data['value'] and len(data['value']['timeSeries']) > 0):
                 time_series = data['value']['timeSeries'][0]
@@ -90,11 +379,160 @@ class USGSApiClient:
                     site_name = "Unknown Site"
                     if 'sourceInfo' in time_series and 'siteName' in time_series['sourceInfo']:
                         site_name = time_series['sourceInfo']['siteName']
-                    return {'flow_cfs': float(latest_value['value']), 'timestamp': latest_value['dateTime'], 'site_name': site_name}
+                    flow_data = {'flow_cfs': float(latest_value['value']), 'timestamp': latest_value['dateTime'], 'site_name': site_name}
+                    self._last_flow_data[site_id] = flow_data
+                    return flow_data
             return None
         except:
             return None
 
+class FlowHistoryStore:
+    """Local store of daily flows with incrementally maintained day-of-year histograms"""
+
+    def __init__(self, db_path: str = FLOW_HISTORY_DB):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # _lock guards the in-memory state and _db_lock the connection; when both are needed,
+        # _lock is taken first, and _db_lock is never held while waiting for _lock
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._histograms = {}
+        self._window_cache = {}
+        self._refreshing = set()
+        self._next_refresh = {}
+        self._refresh_failed = set()
+        low, high = FLOW_HISTOGRAM_LOG10_RANGE
+        self._bucket_edges = np.logspace(low, high, FLOW_HISTOGRAM_BUCKETS + 1)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS daily_values (site TEXT, date TEXT, flow_cfs REAL, PRIMARY KEY (site, date))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS doy_histogram (site TEXT, doy INTEGER, bucket INTEGER, count INTEGER, PRIMARY KEY (site, doy, bucket))')
+
+    def _bucket(self, flow_cfs: float) -> int:
+        low, high = FLOW_HISTOGRAM_LOG10_RANGE
+        position = (math.log10(max(flow_cfs, 10 ** low)) - low) / (high - low)
+        return min(FLOW_HISTOGRAM_BUCKETS - 1, int(position * FLOW_HISTOGRAM_BUCKETS))
+
+    def _day_of_year(self, date_str: str) -> int:
+        return datetime.strptime(date_str[:10], '%Y-%m-%d').timetuple().tm_yday - 1
+
+    def _histogram(self, site_id: str) -> np.ndarray:
+        """Per-site (day of year x bucket) counts, loaded from the database on first use"""
+        if site_id not in self._histograms:
+            histogram = np.zeros((366, FLOW_HISTOGRAM_BUCKETS), dtype=np.int64)
+            with self._db_lock:
+                rows = self._conn.execute('SELECT doy, bucket, count FROM doy_histogram WHERE site = ?', (site_id,)).fetchall()
+            for doy, bucket, count in rows:
+                histogram[doy, bucket] = count
+            self._histograms[site_id] = histogram
+        return self._histograms[site_id]
+
+    def last_date(self, site_id: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._conn.execute('SELECT MAX(date) FROM daily_values WHERE site = ?', (site_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_daily_values(self, site_id: str, daily_values: List[Tuple[str, float]]) -> int:
+        """Store new days and bump their histogram buckets; days already stored are ignored"""
+        with self._lock:
+            histogram = self._histogram(site_id)
+
+        # Commit in batches so percentile lookups only wait for one batch, not the whole backfill
+        added = 0
+        for start in range(0, len(daily_values), FLOW_HISTORY_BATCH_SIZE):
+            increments = []
+            with self._db_lock, self._conn:
+                for date_str, flow_cfs in daily_values[start:start + FLOW_HISTORY_BATCH_SIZE]:
+                    inserted = self._conn.execute('INSERT OR IGNORE INTO daily_values (site, date, flow_cfs) VALUES (?, ?, ?)',
+                                                  (site_id, date_str, flow_cfs)).rowcount
+                    if not inserted:
+                        continue
+                    doy, bucket = self._day_of_year(date_str), self._bucket(flow_cfs)
+                    self._conn.execute('INSERT INTO doy_histogram (site, doy, bucket, count) VALUES (?, ?, ?, 1) '
+                                       'ON CONFLICT (site, doy, bucket) DO UPDATE SET count = count + 1',
+                                       (site_id, doy, bucket))
+                    increments.append((doy, bucket))
+
+            if not increments:
+                continue
+            with self._lock:
+                doys, buckets = zip(*increments)
+                np.add.at(histogram, (list(doys), list(buckets)), 1)
+                for doy in set(doys):
+                    for offset in range(-FLOW_PERCENTILE_WINDOW_DAYS, FLOW_PERCENTILE_WINDOW_DAYS + 1):
+                        self._window_cache.pop((site_id, (doy + offset) % 366), None)
+            added += len(increments)
+        return added
+
+    def ingest(self, client: 'USGSApiClient', site_id: str) -> Optional[int]:
+        """Fetch only the days after the last stored one and add them; None if the fetch failed"""
+        last_date = self.last_date(site_id)
+        start_date = FLOW_HISTORY_START_DATE
+        if last_date:
+            start_date = (datetime.strptime(last_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        daily_values = client.get_daily_values(site_id, start_date)
+        return self.add_daily_values(site_id, daily_values) if daily_values is not None else None
+
+    def refresh_async(self, client: 'USGSApiClient', site_id: str):
+        """Ingest new daily values in the background, daily per site (every 15 minutes after a failure)"""
+        with self._lock:
+            if site_id in self._refreshing or time.monotonic() < self._next_refresh.get(site_id, 0):
+                return
+            self._refreshing.add(site_id)
+
+        def run():
+            added = None
+            try:
+                added = self.ingest(client, site_id)
+            finally:
+                with self._lock:
+                    self._next_refresh[site_id] = time.monotonic() + (86400 if added is not None else 900)
+                    self._refreshing.discard(site_id)
+                    if added is None:
+                        self._refresh_failed.add(site_id)
+                    else:
+                        self._refresh_failed.discard(site_id)
+
+        threading.Thread(target=run, daemon=True, name=f"flow-history-{site_id}").start()
+
+    def refresh_failed(self, site_id: str) -> bool:
+        """Whether the last background ingest for the site failed"""
+        with self._lock:
+            return site_id in self._refresh_failed
+
+    def _window_counts(self, site_id: str, doy: int) -> np.ndarray:
+        """Cumulative bucket counts over the day-of-year window, cached until new data touches it"""
+        key = (site_id, doy)
+        cumulative = self._window_cache.get(key)
+        if cumulative is None:
+            with self._lock:
+                histogram = self._histogram(site_id)
+                days = [(doy + offset) % 366 for offset in range(-FLOW_PERCENTILE_WINDOW_DAYS, FLOW_PERCENTILE_WINDOW_DAYS + 1)]
+                cumulative = np.cumsum(histogram[days].sum(axis=0))
+                self._window_cache[key] = cumulative
+        return cumulative
+
+    def percentile_bands(self, site_id: str, date: datetime, percentiles: Tuple[int, ...] = (10, 25, 50, 75, 90)) -> Optional[Dict]:
+        """Historical flow percentiles (cfs) for this time of year, or None without history"""
+        cumulative = self._window_counts(site_id, date.timetuple().tm_yday - 1)
+        total = int(cumulative[-1])
+        if total == 0:
+            return None
+        bands = {'count': total}
+        for percentile in percentiles:
+            bucket = int(np.searchsorted(cumulative, total * percentile / 100))
+            # Geometric midpoint of the bucket
+            bands[f"p{percentile}"] = math.sqrt(self._bucket_edges[bucket] * self._bucket_edges[bucket + 1])
+        return bands
+
+    def percentile_of(self, site_id: str, date: datetime, flow_cfs: float) -> Optional[float]:
+        """Percentile rank of a flow among historical days at this time of year"""
+        cumulative = self._window_counts(site_id, date.timetuple().tm_yday - 1)
+        total = int(cumulative[-1])
+        if total == 0:
+            return None
+        bucket = self._bucket(flow_cfs)
+        below = cumulative[bucket - 1] if bucket > 0 else 0
+        return 100 * (below + (cumulative[bucket] - below) / 2) / total
+
 class CumberlandRiverFlowCalculator:
     """Practical Cumberland River flow calculator with realistic river approximation"""
     
@@ -217,6 +655,7 @@ class CumberlandRiverFlowCalculator:
         self.dams = {}
         self.usgs_site_info_failed = False
         self.failed_site_count = 0
+        self.site_info_loading = False
         self._initialize_dam_data()
         
         # Convert to lookup dictionary for faster access
@@ -280,11 +719,11 @@ class CumberlandRiverFlowCalculator:
         
         return path_coords
     
-    def attempt_streamstats_flow_path(self, start_lat: float, start_lon: float, distance_miles: float = 50) -> Optional[List[Tuple[float, float]]]:
+    def attempt_streamstats_flow_path(self, start_lat: float, start_lon: float, distance_miles: float = 50, timeout: float = UPSTREAM_TIMEOUT_SECONDS) -> Optional[List[Tuple[float, float]]]:
         """Attempt to use StreamStats Flow Path API (experimental)"""
         try:
             # This is experimental - actual API may be different
-            url = "https://streamstats.usgs.gov/streamstatsservices/navigation/flowpath"
+            url = STREAMSTATS_FLOWPATH_URL
             
             params = {
                 'rcode': '05',  # Ohio River region
@@ -294,7 +733,7 @@ class CumberlandRiverFlowCalculator:
                 'format': 'json'
             }
             
-            response = requests.get(url, params=params, timeout=15)
+            response = requests.get(url, params=params, timeout=timeout)
             
             if response.status_code == 200:
                 data = response.json()
@@ -310,17 +749,24 @@ class CumberlandRiverFlowCalculator:
         
         return None
     
-    def calculate_flow_with_timing(self, selected_dam: str, user_mile: float) -> Dict:
+    def calculate_flow_with_timing(self, selected_dam: str, user_mile: float, deadline: Optional[Deadline] = None) -> Dict:
         """Calculate flow with enhanced river path approximation"""
         # Get dam data
         dam_data = self.dams[selected_dam]
         dam_mile = dam_data['river_mile']
+        partial_reasons = []
         
         # Get coordinates using dense reference points
         user_lat, user_lon = self.get_coordinates_from_mile(user_mile)
         
-        # Get current flow data
-        flow_data = self.get_usgs_flow_data(dam_data['usgs_site'])
+        # Get current flow data, falling back to the last known value
+        flow_data = self.get_usgs_flow_data(dam_data['usgs_site'], deadline=deadline)
+        flow_data_stale = False
+        if not flow_data:
+            if deadline is not None and deadline.expired():
+                partial_reasons.append("live flow data timed out")
+            flow_data = self.usgs_client.get_cached_flow_data(dam_data['usgs_site'])
+            flow_data_stale = flow_data is not None
         
         if flow_data:
             current_flow = flow_data['flow_cfs']
@@ -331,10 +777,15 @@ class CumberlandRiverFlowCalculator:
         
         # Calculate travel distance and time
         if user_mile < dam_mile:  # User is downstream
-            # First attempt StreamStats API (experimental)
-            streamstats_path = self.attempt_streamstats_flow_path(
-                dam_data['lat'], dam_data['lon'], dam_mile - user_mile
-            )
+            # First attempt StreamStats API (experimental), if the time budget allows
+            if deadline is not None and deadline.remaining() < STREAMSTATS_MIN_BUDGET_SECONDS:
+                streamstats_path = None
+                partial_reasons.append("StreamStats routing skipped")
+            else:
+                streamstats_path = self.attempt_streamstats_flow_path(
+                    dam_data['lat'], dam_data['lon'], dam_mile - user_mile,
+                    timeout=deadline.timeout(UPSTREAM_TIMEOUT_SECONDS) if deadline else UPSTREAM_TIMEOUT_SECONDS
+                )
             
             if streamstats_path and len(streamstats_path) > 5:
                 # Use StreamStats path if available
@@ -376,9 +827,12 @@ class CumberlandRiverFlowCalculator:
             'user_coordinates': (user_lat, user_lon),
             'dam_coordinates': (dam_data['lat'], dam_data['lon']),
             'flow_data_available': flow_data is not None,
+            'flow_data_stale': flow_data_stale,
             'river_path': river_path,
             'routing_success': routing_success,
-            'routing_method': routing_method
+            'routing_method': routing_method,
+            'partial': bool(partial_reasons),
+            'partial_reasons': partial_reasons
         }
     
     def _calculate_path_distance(self, path: List[Tuple[float, float]]) -> float:
@@ -393,26 +847,155 @@ class CumberlandRiverFlowCalculator:
             total_distance += self.calculate_distance_miles(lat1, lon1, lat2, lon2)
         
         return total_distance
-    
+
+    def _simplify_path_indices(self, path: List[Tuple[float, float]], tolerance: float) -> List[int]:
+        """Douglas-Peucker simplification, returning the indices of kept points"""
+        if tolerance <= 0 or len(path) < 3:
+            return list(range(len(path)))
+
+        keep = {0, len(path) - 1}
+        stack = [(0, len(path) - 1)]
+        while stack:
+            first, last = stack.pop()
+            (lat1, lon1), (lat2, lon2) = path[first], path[last]
+            seg_lat, seg_lon = lat2 - lat1, lon2 - lon1
+            seg_len_sq = seg_lat ** 2 + seg_lon ** 2
+            max_dist, max_index = 0.0, None
+            for i in range(first + 1, last):
+                lat, lon = path[i]
+                if seg_len_sq == 0:
+                    dist = math.hypot(lat - lat1, lon - lon1)
+                else:
+                    dist = abs(seg_lon * (lat - lat1) - seg_lat * (lon - lon1)) / math.sqrt(seg_len_sq)
+                if dist > max_dist:
+                    max_dist, max_index = dist, i
+            if max_index is not None and max_dist > tolerance:
+                keep.add(max_index)
+                stack.append((first, max_index))
+                stack.append((max_index, last))
+
+        return sorted(keep)
+
+    def build_river_geojson(self, dam_flows: Dict[str, Optional[Dict]], tolerance: float = 0.0) -> Dict:
+        """Build a whole-river GeoJSON FeatureCollection colored by current flow"""
+        features = []
+        dams_by_mile = sorted(self.dams.items(), key=lambda item: item[1]['river_mile'], reverse=True)
+
+        for index, (dam_name, dam_data) in enumerate(dams_by_mile):
+            dam_mile = dam_data['river_mile']
+            next_mile = dams_by_mile[index + 1][1]['river_mile'] if index + 1 < len(dams_by_mile) else 0.0
+
+            flow_data = dam_flows.get(dam_name)
+            if flow_data:
+                dam_flow = flow_data['flow_cfs']
+                data_timestamp = flow_data['timestamp']
+            else:
+                dam_flow = dam_data['capacity_cfs'] * 0.4
+                data_timestamp = None
+
+            # Reach from this dam down to the next dam (or the Ohio River confluence)
+            reach_miles = [m for m in sorted(self.mile_markers.keys(), reverse=True) if next_mile <= m <= dam_mile]
+            reach_path = [self.mile_markers[m] for m in reach_miles]
+
+            # Travel distance along the full-resolution path, so simplification doesn't change timings
+            cumulative_miles = [0.0]
+            for i in range(len(reach_path) - 1):
+                cumulative_miles.append(cumulative_miles[-1] + self._calculate_path_distance(reach_path[i:i + 2]))
+
+            kept = self._simplify_path_indices(reach_path, tolerance)
+            for start, end in zip(kept, kept[1:]):
+                mid_travel = (cumulative_miles[start] + cumulative_miles[end]) / 2
+                flow_cfs = dam_flow * math.exp(-mid_travel / 100)
+                features.append({
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'LineString',
+                        'coordinates': [[round(lon, 5), round(lat, 5)] for lat, lon in (reach_path[start], reach_path[end])]
+                    },
+                    'properties': {
+                        'dam': dam_name,
+                        'start_mile': reach_miles[start],
+                        'end_mile': reach_miles[end],
+                        'flow_cfs': round(flow_cfs),
+                        'arrival_offset_hours': round(cumulative_miles[end] / 3.0, 2),
+                        'flow_data_available': flow_data is not None,
+                        'flow_data_stale': bool(flow_data and flow_data.get('stale')),
+                        'data_timestamp': data_timestamp,
+                        'style': {'color': self._flow_color(flow_cfs, dam_data['capacity_cfs']), 'weight': 4, 'opacity': 0.8}
+                    }
+                })
+
+        return {'type': 'FeatureCollection', 'features': features}
+
+    def _flow_color(self, flow_cfs: float, capacity_cfs: float) -> str:
+        """Map flow as a fraction of dam capacity to a line color"""
+        ratio = flow_cfs / capacity_cfs if capacity_cfs else 0
+        if ratio < 0.1:
+            return '#9ecae1'
+        if ratio < 0.3:
+            return '#4292c6'
+        if ratio < 0.6:
+            return '#08519c'
+        return '#d7301f'
+
+    def build_dam_profile(self, selected_dam: str, dam_flow_cfs: float, step: float = 0.5) -> Dict:
+        """Compact profile below a dam (mile -> coordinates, flow, arrival offset) for client-side scrubbing"""
+        dam_mile = self.dams[selected_dam]['river_mile']
+
+        # Travel distance at each reference point, matching calculate_flow_with_timing's path distance
+        ref_miles = [m for m in sorted(self.mile_markers.keys(), reverse=True) if m <= dam_mile]
+        ref_travel = {ref_miles[0]: 0.0}
+        for upper, lower in zip(ref_miles, ref_miles[1:]):
+            ref_travel[lower] = ref_travel[upper] + self.calculate_distance_miles(*self.mile_markers[upper], *self.mile_markers[lower])
+
+        sample_miles = [round(dam_mile - i * step, 1) for i in range(int(dam_mile / step) + 1)]
+        if sample_miles[-1] > 0:
+            sample_miles.append(0.0)
+
+        profile = {'dam': selected_dam, 'dam_mile': dam_mile, 'dam_flow_cfs': round(dam_flow_cfs),
+                   'miles': [], 'lat': [], 'lon': [], 'flow': [], 'arrival_hours': []}
+        for mile in sample_miles:
+            lat, lon = self.get_coordinates_from_mile(mile)
+            upper = min(m for m in ref_miles if m >= mile)
+            travel_miles = ref_travel[upper] + self.calculate_distance_miles(*self.mile_markers[upper], lat, lon)
+            profile['miles'].append(mile)
+            profile['lat'].append(round(lat, 5))
+            profile['lon'].append(round(lon, 5))
+            profile['flow'].append(round(dam_flow_cfs * math.exp(-travel_miles / 100)))
+            profile['arrival_hours'].append(round(travel_miles / 3.0, 3))
+
+        return profile
+
     def _initialize_dam_data(self):
-        """Initialize dam data"""
-        failed_sites = 0
+        """Initialize dam data with stored names; official USGS names load in the background"""
         for dam_name, dam_info in self.dam_sites.items():
             self.dams[dam_name] = dam_info.copy()
             self.dams[dam_name]['official_name'] = dam_name
-            
-            site_info = self.usgs_client.get_site_info(dam_info['usgs_site'])
-            if site_info and 'official_name' in site_info:
-                self.dams[dam_name]['official_name'] = site_info['official_name']
-            else:
-                failed_sites += 1
-        
-        self.failed_site_count = failed_sites
-        self.usgs_site_info_failed = failed_sites == len(self.dam_sites)
+
+        self.site_info_loading = True
+        threading.Thread(target=self._load_site_info, daemon=True, name='usgs-site-info').start()
+
+    def _load_site_info(self):
+        """Fetch official site names for all dams in parallel"""
+        failed_sites = 0
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.dam_sites)) as pool:
+                futures = {dam_name: pool.submit(self.usgs_client.get_site_info, dam_info['usgs_site'])
+                           for dam_name, dam_info in self.dam_sites.items()}
+            for dam_name, future in futures.items():
+                site_info = future.result()
+                if site_info and 'official_name' in site_info:
+                    self.dams[dam_name]['official_name'] = site_info['official_name']
+                else:
+                    failed_sites += 1
+        finally:
+            self.failed_site_count = failed_sites
+            self.usgs_site_info_failed = failed_sites == len(self.dam_sites)
+            self.site_info_loading = False
     
-    def get_usgs_flow_data(self, site_id: str, days_back: int = 1) -> Optional[Dict]:
+    def get_usgs_flow_data(self, site_id: str, days_back: int = 1, deadline: Optional[Deadline] = None) -> Optional[Dict]:
         """Fetch current flow data"""
-        return self.usgs_client.get_flow_data(site_id, days_back)
+        return self.usgs_client.get_flow_data(site_id, days_back, deadline)
     
     def calculate_distance_miles(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """Calculate distance between two points using Haversine formula"""
@@ -428,17 +1011,293 @@ def get_calculator():
     """Get calculator instance"""
     return CumberlandRiverFlowCalculator()
 
-def create_map(calculator, selected_dam, user_mile):
+@st.cache_resource
+def get_flow_history():
+    """Get the shared flow history store"""
+    return FlowHistoryStore()
+
+class RiverSnapshotStore:
+    """Last complete flow snapshot of every dam, shared by all sessions and refreshed in the background"""
+
+    def __init__(self, calculator):
+        self._calculator = calculator
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._fetched_at = 0.0
+        self._refresh = None  # Event set when the refresh in flight finishes
+
+    def get(self, deadline: Optional[Deadline] = None) -> Tuple[Dict[str, Optional[Dict]], bool]:
+        """Latest snapshot and whether it is partial; never waits beyond the caller's deadline"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._fetched_at < RIVER_SNAPSHOT_TTL_SECONDS:
+                return snapshot, False
+            if self._refresh is None:
+                self._refresh = threading.Event()
+                threading.Thread(target=self._run_refresh, args=(self._refresh,), daemon=True, name='river-snapshot').start()
+            refresh = self._refresh
+
+        # Serve the last complete snapshot while the refresh runs
+        if snapshot is not None:
+            return snapshot, False
+
+        # Nothing complete yet: wait for the refresh within this rerun's budget, then fall back
+        refresh.wait(deadline.remaining() if deadline else None)
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot, False
+        return self._last_known(), True
+
+    def _run_refresh(self, done: threading.Event):
+        try:
+            deadline = Deadline(UPSTREAM_TIMEOUT_SECONDS)
+            with ThreadPoolExecutor(max_workers=len(self._calculator.dams)) as pool:
+                futures = {dam_name: pool.submit(self._calculator.get_usgs_flow_data, dam_data['usgs_site'], 1, deadline)
+                           for dam_name, dam_data in self._calculator.dams.items()}
+            snapshot = {dam_name: future.result() for dam_name, future in futures.items()}
+            # Only complete snapshots are kept; a partial one is retried on the next rerun
+            if all(flow_data is not None for flow_data in snapshot.values()):
+                with self._lock:
+                    self._snapshot = snapshot
+                    self._fetched_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refresh = None
+            done.set()
+
+    def _last_known(self) -> Dict[str, Optional[Dict]]:
+        """Snapshot from each dam's last known flow, marked stale (None where there is none)"""
+        client = self._calculator.usgs_client
+        snapshot = {}
+        for dam_name, dam_data in self._calculator.dams.items():
+            last_known = client.get_cached_flow_data(dam_data['usgs_site'])
+            snapshot[dam_name] = dict(last_known, stale=True) if last_known else None
+        return snapshot
+
+@st.cache_resource
+def get_river_snapshot_store(_calculator):
+    """Get the shared river snapshot store"""
+    return RiverSnapshotStore(_calculator)
+
+def get_river_snapshot(calculator, deadline: Optional[Deadline] = None) -> Tuple[Dict[str, Optional[Dict]], bool]:
+    """Latest flow for every dam, shared by all sessions; returns (snapshot, partial)"""
+    return get_river_snapshot_store(calculator).get(deadline)
+
+def river_geojson_url() -> str:
+    """URL of the static directory, under server.baseUrlPath when the app is served behind a prefix"""
+    base_path = (st.get_option('server.baseUrlPath') or '').strip('/')
+    return f"/{base_path}/app/static" if base_path else "/app/static"
+
+def _write_static_asset(filename: str, body: bytes):
+    """Atomically create or replace a file in the static directory"""
+    fd, tmp_path = tempfile.mkstemp(dir=RIVER_GEOJSON_DIR, prefix=RIVER_GEOJSON_PREFIX, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, os.path.join(RIVER_GEOJSON_DIR, filename))
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _prune_static_assets(keep: set):
+    """Delete river GeoJSON files (and leftover temp files) not published within the retention period"""
+    cutoff = time.time() - RIVER_GEOJSON_RETENTION_SECONDS
+    for filename in os.listdir(RIVER_GEOJSON_DIR):
+        if not filename.startswith(RIVER_GEOJSON_PREFIX) or filename in keep:
+            continue
+        try:
+            path = os.path.join(RIVER_GEOJSON_DIR, filename)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def build_river_geojson_assets(_calculator, snapshot: Dict[str, Optional[Dict]]) -> Dict[int, Dict]:
+    """Serialize the river GeoJSON once per flow snapshot and zoom level, named by content hash"""
+    assets = {}
+    for zoom, tolerance in RIVER_GEOJSON_ZOOM_TOLERANCES.items():
+        geojson = _calculator.build_river_geojson(snapshot, tolerance)
+        body = json.dumps(geojson, separators=(',', ':')).encode('utf-8')
+        assets[zoom] = {
+            'filename': f"{RIVER_GEOJSON_PREFIX}z{zoom}_{hashlib.sha256(body).hexdigest()[:12]}.geojson",
+            'body': body,
+            'features': len(geojson['features'])
+        }
+    return assets
+
+def publish_river_geojson(calculator, snapshot: Dict[str, Optional[Dict]]) -> Dict[int, Dict]:
+    """Make sure the snapshot's GeoJSON tiers exist in the static directory and return their URLs"""
+    # HTTP caching headers and compression come from Streamlit's static file serving
+    # (or a reverse proxy). A file's name is its content hash, so a URL never changes body.
+    assets = build_river_geojson_assets(calculator, snapshot)
+    os.makedirs(RIVER_GEOJSON_DIR, exist_ok=True)
+    written = False
+    published = {}
+    for zoom, asset in assets.items():
+        path = os.path.join(RIVER_GEOJSON_DIR, asset['filename'])
+        try:
+            os.utime(path)  # Still in use, so pruning keeps it
+        except FileNotFoundError:
+            _write_static_asset(asset['filename'], asset['body'])
+            written = True
+        published[zoom] = {
+            'url': f"{river_geojson_url()}/{asset['filename']}",
+            'features': asset['features'],
+            'size_bytes': len(asset['body'])
+        }
+    if written:
+        _prune_static_assets({asset['filename'] for asset in assets.values()})
+    return published
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_dam_profile(_calculator, selected_dam: str, dam_flow_cfs: float, snapshot_id: str) -> Dict:
+    """Per-dam scrubbing profile, rebuilt only when the dam or the data snapshot changes"""
+    return _calculator.build_dam_profile(selected_dam, dam_flow_cfs)
+
+class RiverFlowLayer(folium.MacroElement):
+    """Whole-river flow layer fetched asynchronously from the static GeoJSON tier matching the map zoom"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var tiers = {{ this.urls|tojson }};
+            var zooms = Object.keys(tiers).map(Number).sort(function(a, b) { return a - b; });
+            map.createPane('riverFlow').style.zIndex = 350;  // Below the route and markers
+            var layer = L.geoJSON(null, {
+                pane: 'riverFlow',
+                style: function(feature) { return feature.properties.style; },
+                onEachFeature: function(feature, featureLayer) {
+                    var p = feature.properties;
+                    featureLayer.bindTooltip('<b>' + p.dam + '</b><br>Miles ' + p.start_mile + ' to ' + p.end_mile +
+                        '<br>Flow: ' + p.flow_cfs.toLocaleString() + ' cfs<br>Arrival: +' + p.arrival_offset_hours + ' hours');
+                }
+            }).addTo(map);
+
+            var current = null;
+            function load() {
+                var tier = zooms[0];
+                zooms.forEach(function(zoom) { if (zoom <= map.getZoom()) { tier = zoom; } });
+                if (tier === current) { return; }
+                current = tier;
+                fetch(tiers[tier])
+                    .then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        if (tier !== current) { return; }  // A later zoom change won
+                        layer.clearLayers();
+                        layer.addData(data);
+                    })
+                    .catch(function() { current = null; });
+            }
+            map.on('zoomend', load);
+            load();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, urls: Dict[int, str]):
+        super().__init__()
+        self._name = 'RiverFlowLayer'
+        self.urls = urls
+
+class MileScrubber(folium.MacroElement):
+    """Leaflet slider that moves a marker along a dam profile and updates flow and arrival time in the browser"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var profile = {{ this.profile|tojson }};
+            var marker = L.marker([profile.lat[0], profile.lon[0]], {
+                icon: L.AwesomeMarkers.icon({markerColor: 'red', icon: 'user', prefix: 'fa'})
+            }).addTo(map);
+            var route = L.polyline([], {color: 'darkblue', weight: 5, opacity: 0.8}).addTo(map);
+
+            var control = L.control({position: 'bottomleft'});
+            control.onAdd = function() {
+                var div = L.DomUtil.create('div', 'leaflet-bar');
+                div.style.background = 'white';
+                div.style.padding = '6px 10px';
+                div.style.minWidth = '280px';
+                div.innerHTML = '<input type="range" min="0" max="' + profile.dam_mile + '" step="0.1" style="width:100%">' +
+                    '<div style="font-size:12px"></div>';
+                L.DomEvent.disableClickPropagation(div);
+                L.DomEvent.disableScrollPropagation(div);
+                return div;
+            };
+            control.addTo(map);
+            var slider = control.getContainer().querySelector('input');
+            var readout = control.getContainer().querySelector('div');
+
+            function update(mile) {
+                // Profile miles run downstream from the dam; find the bracketing samples
+                var i = 0;
+                while (i < profile.miles.length - 2 && profile.miles[i + 1] > mile) { i++; }
+                var span = profile.miles[i] - profile.miles[i + 1];
+                var t = span > 0 ? Math.min(1, Math.max(0, (profile.miles[i] - mile) / span)) : 0;
+                function at(values) { return values[i] + t * (values[i + 1] - values[i]); }
+
+                var lat = at(profile.lat), lon = at(profile.lon);
+                var flow = at(profile.flow), hours = at(profile.arrival_hours);
+                var arrival = new Date(Date.now() + hours * 3600 * 1000);
+                var arrivalText = arrival.toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'});
+
+                var coords = [];
+                for (var j = 0; j <= i; j++) { coords.push([profile.lat[j], profile.lon[j]]); }
+                coords.push([lat, lon]);
+                route.setLatLngs(coords);
+                marker.setLatLng([lat, lon]);
+
+                var text = '<b>River Mile ' + mile.toFixed(1) + '</b> (' + (profile.dam_mile - mile).toFixed(1) + ' miles from dam)<br>' +
+                    'Flow: ' + Math.round(flow).toLocaleString() + ' cfs<br>' +
+                    'Arrival: ' + arrivalText + ' (' + hours.toFixed(1) + ' hours)';
+                readout.innerHTML = text;
+                marker.bindTooltip('<b>Your Location</b><br>' + text);
+            }
+
+            slider.value = {{ this.initial_mile|tojson }};
+            slider.addEventListener('input', function() { update(parseFloat(slider.value)); });
+            update(parseFloat(slider.value));
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, profile: Dict, initial_mile: float):
+        super().__init__()
+        self._name = 'MileScrubber'
+        self.profile = profile
+        self.initial_mile = round(min(initial_mile, profile['dam_mile']), 1)
+
+def get_snapshot_id(flow_result: Dict) -> str:
+    """Identifies the flow data behind a result; estimates share one id"""
+    return flow_result['data_timestamp'] if flow_result['flow_data_available'] else 'estimated'
+
+def uses_mile_scrubber(calculator, selected_dam: str, user_mile: float, flow_result: Dict) -> bool:
+    """Whether the map scrubs miles in the browser (estimated routing, location below the dam)"""
+    return "StreamStats" not in flow_result['routing_method'] and user_mile < calculator.dams[selected_dam]['river_mile']
+
+def create_map(calculator, selected_dam, user_mile, river_layer_urls: Optional[Dict[int, str]] = None, deadline: Optional[Deadline] = None):
     """Create map with enhanced river path approximation"""
     
     # Calculate flow and get coordinates
-    result = calculator.calculate_flow_with_timing(selected_dam, user_mile)
+    result = calculator.calculate_flow_with_timing(selected_dam, user_mile, deadline)
     user_lat, user_lon = result['user_coordinates']
     dam_lat, dam_lon = result['dam_coordinates']
     river_path = result['river_path']
-    
-    # Create base map
-    if len(river_path) > 1:
+    dam_data = calculator.dams[selected_dam]
+
+    # Below the dam the in-browser mile scrubber draws the route and the user marker
+    scrubbing = uses_mile_scrubber(calculator, selected_dam, user_mile, result)
+    server_route = not scrubbing
+
+    # Create base map (centered on the reach below the dam when scrubbing, so it doesn't move with the mile)
+    if scrubbing:
+        reach_lat, reach_lon = calculator.get_coordinates_from_mile(max(0.0, dam_data['river_mile'] - 20))
+        center_lat = (dam_lat + reach_lat) / 2
+        center_lon = (dam_lon + reach_lon) / 2
+    elif len(river_path) > 1:
         all_lats = [coord[0] for coord in river_path]
         all_lons = [coord[1] for coord in river_path]
         center_lat = sum(all_lats) / len(all_lats)
@@ -452,10 +1311,14 @@ def create_map(calculator, selected_dam, user_mile):
         zoom_start=9,
         tiles='OpenStreetMap'
     )
-    
+
+    # Whole-river flow layer, loaded by the browser from the precomputed static GeoJSON
+    if river_layer_urls:
+        RiverFlowLayer(river_layer_urls).add_to(m)
+
     # Add dam marker
-    dam_data = calculator.dams[selected_dam]
-    dam_tooltip = f"""<b>{selected_dam}</b><br>Official Name: {dam_data.get('official_name', 'N/A')}<br>River Mile: {dam_data['river_mile']}<br>Elevation: {dam_data['elevation_ft']:.0f} ft<br>Capacity: {dam_data['capacity_cfs']:,} cfs<br>Current Release: {result['current_flow_at_dam']:.0f} cfs<br>Data Time: {result['data_timestamp'][:19]}"""
+    data_time = result['data_timestamp'][:19] if result['flow_data_available'] else "estimated"
+    dam_tooltip = f"""<b>{selected_dam}</b><br>Official Name: {dam_data.get('official_name', 'N/A')}<br>River Mile: {dam_data['river_mile']}<br>Elevation: {dam_data['elevation_ft']:.0f} ft<br>Capacity: {dam_data['capacity_cfs']:,} cfs<br>Current Release: {result['current_flow_at_dam']:.0f} cfs<br>Data Time: {data_time}"""
     
     folium.Marker(
         [dam_lat, dam_lon],
@@ -464,19 +1327,24 @@ def create_map(calculator, selected_dam, user_mile):
         icon=folium.Icon(color='blue', icon='tint', prefix='fa')
     ).add_to(m)
     
+    if scrubbing:
+        profile = get_dam_profile(calculator, selected_dam, result['current_flow_at_dam'], get_snapshot_id(result))
+        MileScrubber(profile, user_mile).add_to(m)
+
     # Add user location marker
     miles_from_dam = dam_data['river_mile'] - user_mile if user_mile < dam_data['river_mile'] else 0
     user_tooltip = f"""<b>Your Location</b><br>River Mile: {user_mile:.1f}<br>Miles from Dam: {miles_from_dam:.1f}<br>Calculated Flow: {result['flow_at_user_location']:.0f} cfs<br>Travel Distance: {result['travel_miles']:.1f} miles<br>Arrival Time: {result['arrival_time'].strftime('%I:%M %p')}<br>Travel Duration: {result['travel_time_hours']:.1f} hours"""
     
-    folium.Marker(
-        [user_lat, user_lon],
-        popup="Your Location",
-        tooltip=user_tooltip,
-        icon=folium.Icon(color='red', icon='user', prefix='fa')
-    ).add_to(m)
+    if server_route:
+        folium.Marker(
+            [user_lat, user_lon],
+            popup="Your Location",
+            tooltip=user_tooltip,
+            icon=folium.Icon(color='red', icon='user', prefix='fa')
+        ).add_to(m)
     
     # Draw the river path
-    if len(river_path) > 1:
+    if server_route and len(river_path) > 1:
         # Color based on method used
         if "StreamStats" in result['routing_method']:
             path_color = 'darkgreen'
@@ -494,28 +1362,28 @@ def create_map(calculator, selected_dam, user_mile):
             opacity=0.8,
             popup=path_popup
         ).add_to(m)
+    
+    # Add mile markers along the path (the whole reach below the dam when scrubbing)
+    if scrubbing or (len(river_path) > 1 and result['travel_miles'] > 0):
+        start_mile = dam_data['river_mile']
+        end_mile = 0.0 if scrubbing else user_mile
+        marker_interval = 20 if start_mile - end_mile > 100 else 10
         
-        # Add mile markers along the path
-        if result['travel_miles'] > 0:
-            start_mile = dam_data['river_mile']
-            end_mile = user_mile
-            marker_interval = 20 if result['travel_miles'] > 100 else 10
-            
-            for mile in range(int(end_mile), int(start_mile), marker_interval):
-                if mile > end_mile:
-                    marker_lat, marker_lon = calculator.get_coordinates_from_mile(mile)
-                    miles_from_dam_marker = start_mile - mile
-                    
-                    folium.CircleMarker(
-                        [marker_lat, marker_lon],
-                        radius=4,
-                        popup=f"Mile {mile}<br>{miles_from_dam_marker:.0f} miles from dam",
-                        color='green',
-                        fill=True,
-                        fillColor='lightgreen',
-                        fillOpacity=0.7,
-                        weight=2
-                    ).add_to(m)
+        for mile in range(int(end_mile), int(start_mile), marker_interval):
+            if mile > end_mile:
+                marker_lat, marker_lon = calculator.get_coordinates_from_mile(mile)
+                miles_from_dam_marker = start_mile - mile
+                
+                folium.CircleMarker(
+                    [marker_lat, marker_lon],
+                    radius=4,
+                    popup=f"Mile {mile}<br>{miles_from_dam_marker:.0f} miles from dam",
+                    color='green',
+                    fill=True,
+                    fillColor='lightgreen',
+                    fillOpacity=0.7,
+                    weight=2
+                ).add_to(m)
     
     # Add all other dams for reference
     for other_dam_name, other_dam_data in calculator.dams.items():
@@ -558,6 +1426,9 @@ def main():
             st.rerun()
         return
 
+    # Bound the upstream calls made during this rerun
+    deadline = Deadline(RERUN_DEADLINE_SECONDS)
+
     # Sidebar controls
     st.sidebar.header("📍 Location Settings")
     
@@ -594,7 +1465,9 @@ def main():
     st.sidebar.markdown("---")
     st.sidebar.subheader("📊 Data Status")
     
-    if calculator.usgs_site_info_failed:
+    if calculator.site_info_loading:
+        st.sidebar.info("⏳ Loading official dam names...")
+    elif calculator.usgs_site_info_failed:
         st.sidebar.warning("⚠️ Using stored dam names")
     else:
         success_rate = len(calculator.dam_sites) - calculator.failed_site_count
@@ -604,7 +1477,7 @@ def main():
     dam_data = calculator.dams[selected_dam]
     flow_data = None
     try:
-        flow_data = calculator.get_usgs_flow_data(dam_data['usgs_site'])
+        flow_data = calculator.get_usgs_flow_data(dam_data['usgs_site'], deadline=deadline)
     except:
         pass
     
@@ -613,7 +1486,45 @@ def main():
         st.sidebar.caption(f"Updated: {flow_data['timestamp'][:19]}")
     else:
         st.sidebar.info("📊 Using estimated flow data")
-    
+
+    # Historical context for today's release
+    try:
+        history = get_flow_history()
+        history.refresh_async(calculator.usgs_client, dam_data['usgs_site'])
+        today = datetime.now()
+        bands = history.percentile_bands(dam_data['usgs_site'], today)
+        if bands and flow_data:
+            percentile = history.percentile_of(dam_data['usgs_site'], today, flow_data['flow_cfs'])
+            st.sidebar.caption(f"📈 Higher than {percentile:.0f}% of days at this time of year")
+            st.sidebar.caption(f"Typical: {bands['p10']:,.0f} – {bands['p90']:,.0f} cfs (median {bands['p50']:,.0f}, p10–p90)")
+        elif not bands and history.refresh_failed(dam_data['usgs_site']):
+            st.sidebar.caption("📈 Flow history unavailable (USGS daily values could not be fetched)")
+        elif not bands:
+            st.sidebar.caption("📈 Building historical flow record...")
+    except Exception as e:
+        st.sidebar.caption(f"Flow history unavailable: {str(e)}")
+
+    # Precomputed whole-river GeoJSON (one serialization per flow snapshot)
+    river_assets = {}
+    snapshot_partial = False
+    try:
+        snapshot, snapshot_partial = get_river_snapshot(calculator, deadline)
+        river_assets = publish_river_geojson(calculator, snapshot)
+    except Exception as e:
+        st.sidebar.caption(f"River GeoJSON unavailable: {str(e)}")
+
+    if river_assets:
+        links = " | ".join(f"[z{zoom}]({asset['url']})" for zoom, asset in river_assets.items())
+        partial_note = " (partial: some dams estimated or last known)" if snapshot_partial else ""
+        st.sidebar.caption(f"🗺️ River GeoJSON: {links}{partial_note}")
+
+    if SHOW_USGS_METRICS:
+        with st.sidebar.expander("📈 USGS request metrics"):
+            metrics = calculator.usgs_client.get_metrics()
+            st.caption(f"Calls: {metrics['calls']} | Upstream requests: {metrics['upstream_requests']}")
+            st.caption(f"Coalesced: {metrics['coalesced_calls']} ({metrics['coalescing_ratio']:.0%})")
+            st.caption(f"Rate limiter queue: {metrics['queue_depth']} (max {metrics['max_queue_depth']}) | Rejected: {metrics['rate_limited']}")
+
     st.sidebar.markdown("---")
     st.sidebar.info("🎯 **Enhanced River Path** - Denser coordinate points for better approximation!")
     
@@ -624,13 +1535,19 @@ def main():
         st.subheader("🗺️ Interactive Map - Enhanced River Path")
         
         try:
-            river_map, flow_result = create_map(calculator, selected_dam, user_mile)
-            st_folium(river_map, width=700, height=500, key=f"enhanced_river_map_{selected_dam}_{user_mile}")
+            river_layer_urls = {zoom: asset['url'] for zoom, asset in river_assets.items()}
+            river_map, flow_result = create_map(calculator, selected_dam, user_mile, river_layer_urls, deadline)
+            # st_folium keys the component on the map's JS, so a new dam, data snapshot or sidebar mile
+            # remounts the map; scrubbing, panning and zooming inside it stay in the browser
+            st_folium(river_map, width=700, height=500, returned_objects=[],
+                      key=f"enhanced_river_map_{selected_dam}_{get_snapshot_id(flow_result)}")
+            if uses_mile_scrubber(calculator, selected_dam, user_mile, flow_result):
+                st.caption("🎚️ Drag the slider on the map to scrub river miles without reloading")
             
         except Exception as e:
             st.error(f"🗺️ Map error: {str(e)}")
             try:
-                flow_result = calculator.calculate_flow_with_timing(selected_dam, user_mile)
+                flow_result = calculator.calculate_flow_with_timing(selected_dam, user_mile, deadline)
             except Exception as calc_error:
                 st.error(f"Calculation error: {str(calc_error)}")
                 return
@@ -639,15 +1556,23 @@ def main():
         st.subheader("📊 Flow Information")
         
         try:
-            st.metric("💧 Flow at Your Location", f"{flow_result['flow_at_user_location']:.0f} cfs", help="Calculated flow rate at your river mile")
+            # These figures follow the sidebar mile; the map slider shows its own readout
+            if uses_mile_scrubber(calculator, selected_dam, user_mile, flow_result):
+                st.caption(f"📍 At sidebar mile {user_mile:.1f} (the map slider's readout is separate)")
+            st.metric(f"💧 Flow at Mile {user_mile:.1f}", f"{flow_result['flow_at_user_location']:.0f} cfs", help="Calculated flow rate at the river mile entered in the sidebar")
             st.metric("🏭 Dam Release Rate", f"{flow_result['current_flow_at_dam']:.0f} cfs", help="Current release from selected dam")
-            st.metric("⏰ Water Arrival Time", flow_result['arrival_time'].strftime('%I:%M %p'), help="When water released now will reach you")
-            st.metric("📏 Travel Distance", f"{flow_result['travel_miles']:.1f} miles", help="Distance along enhanced river path")
+            st.metric("⏰ Water Arrival Time", flow_result['arrival_time'].strftime('%I:%M %p'), help="When water released now will reach the sidebar mile")
+            st.metric("📏 Travel Distance", f"{flow_result['travel_miles']:.1f} miles", help="Distance along enhanced river path to the sidebar mile")
             
-            if flow_result['flow_data_available']:
+            if flow_result['flow_data_available'] and not flow_result['flow_data_stale']:
                 st.success("🎯 Using live USGS data")
+            elif flow_result['flow_data_available']:
+                st.warning("🕒 Using last known USGS data")
             else:
                 st.warning("📊 Using estimated data")
+
+            if flow_result['partial']:
+                st.warning(f"⏱️ Partial result: {', '.join(flow_result['partial_reasons'])}")
             
             # River routing status
             if "StreamStats" in flow_result.get('routing_method', ''):
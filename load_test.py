@@ -0,0 +1,232 @@
+"""Concurrent-session load test for the Cumberland River Flow Calculator.
+
+Simulates many Streamlit sessions with ``streamlit.testing.v1.AppTest``.
+Each session changes dam and river mile and reruns the script. All USGS
+and StreamStats traffic goes to a local stub server with configurable
+latency, running in its own process. Flow history and the river GeoJSON
+go to a temporary directory. Reports p50/p95/p99 rerun latency, and CPU
+and RSS of the app process.
+
+    python load_test.py --sessions 50 --reruns 5 --latency 0.3
+"""
+import argparse
+import ast
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+DAM_NAMES = ['Wolf Creek Dam', 'Dale Hollow Dam', 'Cordell Hull Dam', 'Old Hickory Dam', 'Cheatham Dam', 'Barkley Dam']
+
+
+class UpstreamStubHandler(BaseHTTPRequestHandler):
+    """Serves canned NWIS instantaneous/daily values and StreamStats responses after a fixed delay"""
+
+    latency_seconds = 0.0
+    request_count = None  # multiprocessing.Value shared with the load-test process
+
+    def do_GET(self):
+        with self.request_count.get_lock():
+            self.request_count.value += 1
+        time.sleep(self.latency_seconds)
+
+        parsed = urlparse(self.path)
+        if parsed.path.startswith('/nwis/iv'):
+            site = parse_qs(parsed.query).get('sites', ['00000000'])[0]
+            body = {
+                'value': {
+                    'timeSeries': [{
+                        'sourceInfo': {'siteName': f"STUB SITE {site}"},
+                        'values': [{'value': [{'value': str(random.randint(5000, 60000)), 'dateTime': datetime.now().isoformat()}]}]
+                    }]
+                }
+            }
+            self._send_json(200, body)
+        elif parsed.path.startswith('/nwis/dv'):
+            today = datetime.now().date()
+            values = [{'value': str(random.randint(5000, 60000)), 'dateTime': f"{today - timedelta(days=days_ago)}T00:00:00.000"}
+                      for days_ago in range(3650, 0, -1)]
+            self._send_json(200, {'value': {'timeSeries': [{'values': [{'value': values}]}]}})
+        elif parsed.path.startswith('/streamstats'):
+            self._send_json(200, {'featurecollection': []})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _send_json(self, status: int, body: Dict):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stub(latency_seconds: float, request_count, port_queue):
+    """Stub server process entry point; reports its port through the queue"""
+    UpstreamStubHandler.latency_seconds = latency_seconds
+    UpstreamStubHandler.request_count = request_count
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamStubHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stub_server(latency_seconds: float, request_count) -> multiprocessing.Process:
+    """Start the upstream stub in a separate process and point the app at it"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(latency_seconds, request_count, port_queue), daemon=True)
+    process.start()
+
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+    work_dir = tempfile.mkdtemp(prefix='flow-load-test-')
+    os.environ['USGS_IV_URL'] = f"{base_url}/nwis/iv/"
+    os.environ['USGS_DV_URL'] = f"{base_url}/nwis/dv/"
+    os.environ['STREAMSTATS_FLOWPATH_URL'] = f"{base_url}/streamstats/navigation/flowpath"
+    os.environ['FLOW_HISTORY_DB'] = os.path.join(work_dir, 'flow_history.sqlite')
+    os.environ['RIVER_GEOJSON_DIR'] = os.path.join(work_dir, 'static')
+    return process
+
+
+def serialize_script_compilation():
+    """Every AppTest session compiles app.py itself, and concurrent ast.parse calls
+    can fail on CPython 3.11 ("AST constructor recursion depth mismatch").
+    A real server compiles the script once, so parse under a lock."""
+    parse, lock = ast.parse, threading.Lock()
+
+    def locked_parse(*args, **kwargs):
+        with lock:
+            return parse(*args, **kwargs)
+
+    ast.parse = locked_parse
+
+
+def run_session(session_id: int, reruns: int, timeout: float) -> Dict:
+    """Simulate one user: initial page load, then dam/mile changes"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(session_id)
+    latencies = []
+    errors = 0
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    for step in range(reruns + 1):
+        try:
+            if step > 0:
+                dam = rng.choice(DAM_NAMES)
+                at.sidebar.selectbox[0].select(dam)
+                at.sidebar.number_input[0].set_value(round(rng.uniform(0.0, 460.0), 1))
+            start = time.perf_counter()
+            at.run()
+            latencies.append(time.perf_counter() - start)
+            # main() reports map and calculation failures with st.error instead of raising
+            if at.exception or at.error:
+                errors += 1
+        except Exception:
+            errors += 1
+
+    return {'session': session_id, 'latencies': latencies, 'errors': errors}
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux), falling back to peak RSS"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_load_test(sessions: int, concurrency: int, reruns: int, latency: float, timeout: float) -> Dict:
+    """Run all sessions concurrently and summarize latency and resource usage"""
+    serialize_script_compilation()
+    request_count = multiprocessing.Value('i', 0)
+    stub = start_stub_server(latency, request_count)
+    rss_samples: List[float] = [current_rss_mb()]
+    sampling = threading.Event()
+
+    def sample_rss():
+        while not sampling.wait(0.25):
+            rss_samples.append(current_rss_mb())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: run_session(i, reruns, timeout), range(sessions)))
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_seconds = time.process_time() - cpu_start
+
+    sampling.set()
+    sampler.join()
+    stub.terminate()
+
+    latencies = np.array([lat for r in results for lat in r['latencies']])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+    return {
+        'sessions': sessions,
+        'concurrency': concurrency,
+        'reruns_per_session': reruns + 1,
+        'upstream_latency_s': latency,
+        'total_reruns': int(len(latencies)),
+        'errors': sum(r['errors'] for r in results),
+        'upstream_requests': request_count.value,
+        'p50_s': float(p50),
+        'p95_s': float(p95),
+        'p99_s': float(p99),
+        'max_s': float(latencies.max()) if len(latencies) else 0.0,
+        'wall_s': wall_seconds,
+        'cpu_s': cpu_seconds,
+        'cpu_utilization': cpu_seconds / wall_seconds if wall_seconds else 0.0,
+        'rss_start_mb': rss_samples[0],
+        'rss_peak_mb': max(rss_samples),
+        'rss_end_mb': current_rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test against a local USGS/StreamStats stub")
+    parser.add_argument('--sessions', type=int, default=50, help="Number of simulated users")
+    parser.add_argument('--concurrency', type=int, default=None, help="Sessions running at once (default: all)")
+    parser.add_argument('--reruns', type=int, default=3, help="Dam/mile changes per session after the first load")
+    parser.add_argument('--latency', type=float, default=0.2, help="Upstream stub latency in seconds")
+    parser.add_argument('--rate-limit-per-hour', type=float, default=None, help="Override the app's USGS client-side rate limit")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Per-rerun timeout in seconds")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    if args.rate_limit_per_hour is not None:
+        os.environ['USGS_RATE_LIMIT_PER_HOUR'] = str(args.rate_limit_per_hour)
+
+    report = run_load_test(args.sessions, args.concurrency or args.sessions, args.reruns, args.latency, args.timeout)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Sessions: {report['sessions']} (concurrency {report['concurrency']}), "
+          f"{report['total_reruns']} reruns, {report['errors']} errors")
+    print(f"Upstream: {report['upstream_latency_s']:.2f} s latency, {report['upstream_requests']} requests")
+    print(f"Rerun latency: p50 {report['p50_s']:.3f} s | p95 {report['p95_s']:.3f} s | "
+          f"p99 {report['p99_s']:.3f} s | max {report['max_s']:.3f} s")
+    print(f"App process CPU: {report['cpu_s']:.1f} s over {report['wall_s']:.1f} s wall ({report['cpu_utilization']:.0%})")
+    print(f"App process RSS: {report['rss_start_mb']:.0f} MB start, {report['rss_peak_mb']:.0f} MB peak, {report['rss_end_mb']:.0f} MB end")
+
+
+if __name__ == "__main__":
+    main()